@@ -6,55 +6,105 @@ Created on Wed Oct 28 19:59:54 2020
 """
 
 import socket
+import struct
 import traceback
 
+# a command is two big-endian 16-bit words: header (command code) and value
+_PACK_BE_HH = struct.Struct('>HH').pack
+_PACK_BE_HHHH = struct.Struct('>HHHH').pack
+
+def eth_init(host, port):
+    s = socket.socket()
+    # send small commands right away instead of waiting for ACKs (Nagle),
+    # and keep a batched payload in one send
+    s.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    s.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, 1 << 20)
+    print("connecting")
+    s.connect((host,port))
+    print("connected")
+    # drain stale data without waiting: stop as soon as the queue is empty
+    s.setblocking(False)
+    while True:
+        try :
+            if not s.recv(65536):
+                break
+        except BlockingIOError:
+            break
+    s.setblocking(True)
+    return s
+
+def send_buffers(s, bufs):
+    # send a list of command buffers with as few syscalls as possible:
+    # scatter-gather sendmsg where available, one joined sendall elsewhere
+    if not hasattr(s, "sendmsg"):
+        s.sendall(b"".join(bufs))
+        return
+    bufs = [memoryview(buf) for buf in bufs]
+    while bufs:
+        n = s.sendmsg(bufs)
+        # drop what has been sent, keep the tail of a partially sent buffer
+        while bufs and n >= len(bufs[0]):
+            n -= len(bufs[0])
+            bufs.pop(0)
+        if n:
+            bufs[0] = bufs[0][n:]
+
 class Cmd(object):
     def __init__(self):
         self.text = "command class"
 
     def cmd_send_pulse(self, mask):
-        buf = 0x000b0000 | (0x0000ffff & mask)
-        buf = buf.to_bytes(length=4, byteorder='big', signed=False)
-        return buf
+        return _PACK_BE_HH(0x000b, 0xffff & mask)
 
     def cmd_read_status(self, addr):
-        buf = (0xffff0000 & ((0x8000 + addr) << 16));
-        buf = buf.to_bytes(length=4, byteorder='big', signed=False)
-        return buf
+        return _PACK_BE_HH(0xffff & (0x8000 + addr), 0x0000)
 
     def cmd_write_register(self, addr, val):
-        buf = (0xffff0000 & ((0x0020 + addr) << 16)) | (0x0000ffff & val);
-        buf = buf.to_bytes(length=4, byteorder='big', signed=False)
-        return buf
+        return _PACK_BE_HH(0xffff & (0x0020 + addr), 0xffff & val)
 
     def cmd_read_register(self, addr):
-        buf = (0xffff0000 & ((0x8020 + addr) << 16));
-        buf = buf.to_bytes(length=4, byteorder='big', signed=False)
-        return buf
+        return _PACK_BE_HH(0xffff & (0x8020 + addr), 0x0000)
 
     def cmd_read_datafifo(self, n):
-        buf0 = (0xffff0000 & (0x001a << 16)) | (0x0000ffff & (n>>16))
-        buf0 = buf0.to_bytes(length=4, byteorder='big', signed=False)
-        buf1 = (0xffff0000 & (0x0019 << 16)) | (0x0000ffff & n);
-        buf1 = buf1.to_bytes(length=4, byteorder='big', signed=False)
-        buf = buf0 + buf1
-        return buf
+        # high half of n to 0x001a, low half to 0x0019, in one 8-byte pack
+        return _PACK_BE_HHHH(0x001a, 0xffff & (n>>16), 0x0019, 0xffff & n)
+
+class CmdBatch(Cmd):
+    # collects commands and sends them together with flush_to
+    def __init__(self):
+        Cmd.__init__(self)
+        self.text = "command batch class"
+        self.bufs = []
+
+    def append(self, buf):
+        # prebuilt command buffers
+        self.bufs.append(buf)
+
+    def send_pulse(self, mask):
+        self.bufs.append(self.cmd_send_pulse(mask))
+
+    def read_status(self, addr):
+        self.bufs.append(self.cmd_read_status(addr))
+
+    def write_register(self, addr, val):
+        self.bufs.append(self.cmd_write_register(addr, val))
+
+    def read_register(self, addr):
+        self.bufs.append(self.cmd_read_register(addr))
+
+    def read_datafifo(self, n):
+        self.bufs.append(self.cmd_read_datafifo(n))
+
+    def flush_to(self, s):
+        send_buffers(s, self.bufs)
+        self.bufs = []
 
 if __name__ == "__main__":
 
-    s = socket.socket()
     host = '192.168.2.3'
     port = 1024
-    print("connecting")
-    s.connect((host,port))
-    s.settimeout(0.5)
-    print("connected")
-    while True:
-        try :
-            s.recv(1024)
-        except socket.timeout:
-            break
-    
+    s = eth_init(host, port)
+
     cmd = Cmd()
 
     ret = cmd.cmd_read_datafifo(0x3)
@@ -1,23 +1,27 @@
 from command import *
+from array import array
+import functools
 import socket
 import time
 
 Delay=0.001
 
+# DRP Address of ClkReg1/ClkReg2 for CLKOUT 0~6, indexed by clk_id
+CLKREG1_DRP_ADDR = (0x0008,0x000A,0x000C,0x000E,0x0010,0x0006,0x0012)
+CLKREG2_DRP_ADDR = (0x0009,0x000B,0x000D,0x000F,0x0011,0x0007,0x0013)
+# ClkReg2 bit mask, 0xFC00 for the other clk_id : refer to datasheet
+CLKREG2_MASK = {0:0x8000, 5:0xC000, 6:0xC000}
+
+# shared command builder for the prebuilt register writes
+_cmd = Cmd()
+
 ###################################################
 # functions for mmcm control
 ###################################################
-def mmcm_reconfig(s, cmd, clkb_mult, clkb_frac, clk_div, clk_id, clkout_div_high,clkout_div_low,duty_50_force, clkout_frac, phase_mux, phase_dalay):
-    # readme
-    # clock = clk * clkb_mult.clkb_frac / clk_div / (clkout_div_high+clkout_div_low).clkout_frac
-    # clkb_mult : 2 to 64
-    # clkb_frac : 4 bits, bit 3:1 with 0.125 accuracy, bit 0 for enable
-    # clk_div : 1 to 128
-    # clkout_div_high : 1 to 64
-    # clkout_div_low : 1 to 64
-    # phase_mux : 1 to 7, resolution is 1/8 VCO period, VCO frequency is 200MHz * clkb_mult
-    # clkout_frac : same with clkb_frac
-
+# the register writes are a pure function of the arguments, so the command
+# buffers are built once per configuration and reused on later calls
+@functools.lru_cache(maxsize=None)
+def _build_mmcm_payload(clkb_mult, clkb_frac, clk_div, clk_id, clkout_div_high,clkout_div_low,duty_50_force, clkout_frac, phase_mux, phase_dalay):
     # clk_id 0xA
     # clkb_mult, clkb_frac, clk_div
     # clkb_mult = 0x1
@@ -30,71 +34,52 @@ def mmcm_reconfig(s, cmd, clkb_mult, clkb_frac, clk_div, clk_id, clkout_div_high
     # "HIGH" : High bandwidth
     # "OPTIMIZED" : Optimized bandwidth
 
+    # all register writes are collected here, mmcm_reconfig sends them in one go
+    batch = CmdBatch()
+    # resolve the command builder once instead of on every register write
+    write_register = batch.write_register
+
     #
     # power bits
     #
-    ret = cmd.cmd_write_register(0,0xFFFF)
-    s.sendall(ret)
+    write_register(0,0xFFFF)
     # time.sleep(Delay)
-    ret = cmd.cmd_write_register(1,0x0000)
-    s.sendall(ret)
+    write_register(1,0x0000)
     # time.sleep(Delay)
-    ret = cmd.cmd_write_register(2,0x0028)
-    s.sendall(ret)
+    write_register(2,0x0028)
     # time.sleep(Delay)
 
     #
     # ClkReg1 for CLKOUT 0~6
     #
     # HIGH_TIME = clkout_div // 2
+    clkout_div = clkout_div_high + clkout_div_low
     if duty_50_force == 1:
-        HIGH_TIME = (clkout_div_high+clkout_div_low) // 2
-        if ((clkout_div_high+clkout_div_low) % 2) == 1:
-            LOW_TIME = HIGH_TIME + 1
-        else:
-            LOW_TIME = HIGH_TIME
+        # an odd divider puts the extra cycle in LOW_TIME and sets EDGE
+        clkout_edge = clkout_div & 1
+        HIGH_TIME = clkout_div >> 1
+        LOW_TIME = HIGH_TIME + clkout_edge
     else:
-        HIGH_TIME = clkout_div_high
-        LOW_TIME = clkout_div_low
+        HIGH_TIME, LOW_TIME, clkout_edge = clkout_div_high, clkout_div_low, 0
 
     clkout_reg_1 = (HIGH_TIME << 6) + LOW_TIME + (phase_mux << 13)
     # mask
     clkout_reg_1_hex = (clkout_reg_1) & 0x0FFF
     # print hex(clkout_reg_1_hex)
-    ret = cmd.cmd_write_register(3,clkout_reg_1_hex)
-    s.sendall(ret)
+    write_register(3,clkout_reg_1_hex)
     # time.sleep(Delay)
     # bit mask : refer to datasheet
-    ret = cmd.cmd_write_register(4,0x1000)
-    s.sendall(ret)
+    write_register(4,0x1000)
     # time.sleep(Delay)
     # DRP Address
-    rom_id = 5
-    if      clk_id == 0:
-        ret = cmd.cmd_write_register(rom_id,0x0008)
-    elif clk_id == 1:
-        ret = cmd.cmd_write_register(rom_id,0x000A)
-    elif clk_id == 2:
-        ret = cmd.cmd_write_register(rom_id,0x000C)
-    elif clk_id == 3:
-        ret = cmd.cmd_write_register(rom_id,0x000E)
-    elif clk_id == 4:
-        ret = cmd.cmd_write_register(rom_id,0x0010)
-    elif clk_id == 5:
-        ret = cmd.cmd_write_register(rom_id,0x0006)
-    elif clk_id == 6:
-        ret = cmd.cmd_write_register(rom_id,0x0012)
-    s.sendall(ret)
+    write_register(5,CLKREG1_DRP_ADDR[clk_id])
     # time.sleep(Delay)
 
     #
     # ClkReg2 for CLKOUT 0~6
     #
-    NO_COUNT = 1 if (clkout_div_high+clkout_div_low) == 1 else 0
-    if duty_50_force == 1:
-        EDGE = 1 if ((clkout_div_high+clkout_div_low) % 2) == 1 else 0
-    else:
-        EDGE = 0
+    NO_COUNT = int(clkout_div == 1)
+    EDGE = clkout_edge
     # FRAC_WF_R is been set to 0
     clkout_reg_2 = (NO_COUNT << 6) + (EDGE << 7) + (clkout_frac << 11) + phase_dalay
     # mask
@@ -102,204 +87,101 @@ def mmcm_reconfig(s, cmd, clkb_mult, clkb_frac, clk_div, clk_id, clkout_div_high
         clkout_reg_2_hex = (clkout_reg_2) & 0x78FF
     else:
         clkout_reg_2_hex = (clkout_reg_2) & 0x00FF
-    ret = cmd.cmd_write_register(6,clkout_reg_2_hex)
-    s.sendall(ret)
+    write_register(6,clkout_reg_2_hex)
     # time.sleep(Delay)
     # bit mask : refer to datasheet
-    if clk_id == 0:
-        ret = cmd.cmd_write_register(7,0x8000)
-    elif (clk_id == 5) or (clk_id == 6):
-        ret = cmd.cmd_write_register(7,0xC000)
-    else:
-        ret = cmd.cmd_write_register(7,0xFC00)
-    s.sendall(ret)
+    write_register(7,CLKREG2_MASK.get(clk_id,0xFC00))
     # time.sleep(Delay)
     # DRP Address
-    rom_id = 8
-    if      clk_id == 0:
-        ret = cmd.cmd_write_register(rom_id,0x0009)
-    elif clk_id == 1:
-        ret = cmd.cmd_write_register(rom_id,0x000B)
-    elif clk_id == 2:
-        ret = cmd.cmd_write_register(rom_id,0x000D)
-    elif clk_id == 3:
-        ret = cmd.cmd_write_register(rom_id,0x000F)
-    elif clk_id == 4:
-        ret = cmd.cmd_write_register(rom_id,0x0011)
-    elif clk_id == 5:
-        ret = cmd.cmd_write_register(rom_id,0x0007)
-    elif clk_id == 6:
-        ret = cmd.cmd_write_register(rom_id,0x0013)
-    s.sendall(ret)
+    write_register(8,CLKREG2_DRP_ADDR[clk_id])
     # time.sleep(Delay)
 
     #
     # divider
     #
-    NO_COUNT = 1 if clk_div == 1 else 0
-    EDGE = 1 if (clk_div % 2) == 1 else 0
-    HIGH_TIME = clk_div // 2
+    NO_COUNT = int(clk_div == 1)
+    EDGE = clk_div & 1
+    HIGH_TIME = clk_div >> 1
     # the duty is 50%, so the LOW TIME equals to HIGH TIME
     LOW_TIME = HIGH_TIME
     div_reg = (EDGE << 13) + (NO_COUNT << 12) + (HIGH_TIME << 6) + LOW_TIME
     # mask
     div_reg = (div_reg) & 0x3fff
-    ret = cmd.cmd_write_register(9,div_reg)
-    s.sendall(ret)
+    write_register(9,div_reg)
     # time.sleep(Delay)
     # bit mask : refer to datasheet
-    ret = cmd.cmd_write_register(10,0xC000)
-    s.sendall(ret)
+    write_register(10,0xC000)
     # time.sleep(Delay)
     # DRP Address
-    ret = cmd.cmd_write_register(11,0x0016)
-    s.sendall(ret)
+    write_register(11,0x0016)
     # time.sleep(Delay)
 
     #
     # reg1 for feedback
     #
-    HIGH_TIME = clkb_mult // 2
+    HIGH_TIME = clkb_mult >> 1
     # the duty is 50%, so the LOW TIME equals to HIGH TIME
     LOW_TIME = HIGH_TIME
     clkb_reg_1 = (HIGH_TIME << 6) + LOW_TIME
     # mask
     clkb_reg_1_hex = (clkb_reg_1) & 0x0FFF
-    ret = cmd.cmd_write_register(12,clkb_reg_1_hex)
-    s.sendall(ret)
+    write_register(12,clkb_reg_1_hex)
     # time.sleep(Delay)
     # bit mask : refer to datasheet
-    ret = cmd.cmd_write_register(13,0x1000)
-    s.sendall(ret)
+    write_register(13,0x1000)
     # time.sleep(Delay)
     # DRP Address
-    ret = cmd.cmd_write_register(14,0x0014)
-    s.sendall(ret)
+    write_register(14,0x0014)
     # time.sleep(Delay)
 
     #
     # reg2 for feedback
     #
-    NO_COUNT = 1 if clkb_mult == 1 else 0
-    EDGE = 1 if (clkb_mult % 2) == 1 else 0
+    NO_COUNT = int(clkb_mult == 1)
+    EDGE = clkb_mult & 1
     # FRAC_WF_R is been set to 0
     clkb_reg_2 = (NO_COUNT << 6) + (EDGE << 7) + (clkb_frac << 11)
     # mask
     clkb_reg_2 = (clkb_reg_2) & 0x78C0
-    ret = cmd.cmd_write_register(15,clkb_reg_2)
-    s.sendall(ret)
-    # time.sleep(Delay)
-    # bit mask : refer to datasheet
-    ret = cmd.cmd_write_register(16,0x8000)
-    s.sendall(ret)
-    # time.sleep(Delay)
-    # DRP Address
-    ret = cmd.cmd_write_register(17,0x0015)
-    s.sendall(ret)
-    # time.sleep(Delay)
-
-    #
-    # reg1 for lock
-    #
-    lock_reg = lock_table[clkb_mult-1];
-    lock_reg1 = (lock_reg >> 20) & 0x03FF
-    ret = cmd.cmd_write_register(18,lock_reg1)
-    s.sendall(ret)
-    # time.sleep(Delay)
-    # bit mask : refer to datasheet
-    ret = cmd.cmd_write_register(19,0xFC00)
-    s.sendall(ret)
-    # time.sleep(Delay)
-    # DRP Address
-    ret = cmd.cmd_write_register(20,0x0018)
-    s.sendall(ret)
-    # time.sleep(Delay)
-
-    #
-    # reg2 for lock
-    #
-    lock_reg2 = (((lock_reg >> 30) & 0x001F) << 10) + (lock_reg & 0x03FF)
-    ret = cmd.cmd_write_register(21,lock_reg2)
-    s.sendall(ret)
-    # time.sleep(Delay)
-    # bit mask : refer to datasheet
-    ret = cmd.cmd_write_register(22,0x8000)
-    s.sendall(ret)
-    # time.sleep(Delay)
-    # DRP Address
-    ret = cmd.cmd_write_register(23,0x0019)
-    s.sendall(ret)
-    # time.sleep(Delay)
-
-    #
-    # reg3 for lock
-    #
-    lock_reg3 = (((lock_reg >> 35) & 0x001F) << 10) + ((lock_reg >> 10) & 0x03FF)
-    ret = cmd.cmd_write_register(24,lock_reg3)
-    s.sendall(ret)
+    write_register(15,clkb_reg_2)
     # time.sleep(Delay)
     # bit mask : refer to datasheet
-    ret = cmd.cmd_write_register(25,0x8000)
-    s.sendall(ret)
+    write_register(16,0x8000)
     # time.sleep(Delay)
     # DRP Address
-    ret = cmd.cmd_write_register(26,0x001A)
-    s.sendall(ret)
+    write_register(17,0x0015)
     # time.sleep(Delay)
 
     #
-    # reg1 for filter
+    # reg1/2/3 for lock, reg1/2 for filter
+    # prebuilt at import time, see LOCK_CMDS and FILTER_CMDS
     #
-    if bandwidth == "LOW":
-        filter_reg = filter_table_low[clkb_mult-1]
-    elif bandwidth == "LOW_SS":
-        filter_reg = filter_table_low_ss[clkb_mult-1]
-    elif bandwidth == "HIGH":
-        filter_reg = filter_table_high[clkb_mult-1]
-    elif bandwidth == "OPTIMIZED":
-        filter_reg = filter_table_optimized[clkb_mult-1]
-    filter_reg1 = (((filter_reg >> 9) & 0x0001) << 15) + (((filter_reg >> 7) & 0x0003) << 11) + (((filter_reg >> 6) & 0x0001) << 8)
-    ret = cmd.cmd_write_register(27,filter_reg1)
-    s.sendall(ret)
-    # time.sleep(Delay)
-    # bit mask : refer to datasheet
-    ret = cmd.cmd_write_register(28,0x66FF)
-    s.sendall(ret)
-    # time.sleep(Delay)
-    # DRP Address
-    ret = cmd.cmd_write_register(29,0x004E)
-    s.sendall(ret)
-    # time.sleep(Delay)
-
-    #
-    # reg2 for filter
-    #
-    filter_reg2 = (((filter_reg >> 5) & 0x0001) << 15) + (((filter_reg >> 3) & 0x0003) << 11) + (((filter_reg >> 1) & 0x0003) << 7) + (((filter_reg) & 0x0001) << 4)
-    ret = cmd.cmd_write_register(30,filter_reg2)
-    s.sendall(ret)
-    # time.sleep(Delay)
-    # bit mask : refer to datasheet
-    ret = cmd.cmd_write_register(31,0x666F)
-    s.sendall(ret)
-    # time.sleep(Delay)
-    # DRP Address
-    ret = cmd.cmd_write_register(32,0x004F)
-    s.sendall(ret)
-    # time.sleep(Delay)
+    batch.append(LOCK_CMDS[clkb_mult-1])
+    batch.append(FILTER_CMDS[bandwidth][clkb_mult-1])
 
     #
     # power bits
     #
-    ret = cmd.cmd_write_register(33,0x0000)
-    s.sendall(ret)
+    write_register(33,0x0000)
     # time.sleep(Delay)
-    ret = cmd.cmd_write_register(34,0x0000)
-    s.sendall(ret)
+    write_register(34,0x0000)
     # time.sleep(Delay)
-    ret = cmd.cmd_write_register(35,0x0028)
-    s.sendall(ret)
+    write_register(35,0x0028)
     # time.sleep(Delay)
+    return tuple(batch.bufs)
 
+def mmcm_reconfig(s, cmd, clkb_mult, clkb_frac, clk_div, clk_id, clkout_div_high,clkout_div_low,duty_50_force, clkout_frac, phase_mux, phase_dalay):
+    # readme
+    # clock = clk * clkb_mult.clkb_frac / clk_div / (clkout_div_high+clkout_div_low).clkout_frac
+    # clkb_mult : 2 to 64
+    # clkb_frac : 4 bits, bit 3:1 with 0.125 accuracy, bit 0 for enable
+    # clk_div : 1 to 128
+    # clkout_div_high : 1 to 64
+    # clkout_div_low : 1 to 64
+    # phase_mux : 1 to 7, resolution is 1/8 VCO period, VCO frequency is 200MHz * clkb_mult
+    # clkout_frac : same with clkb_frac
+
+    payload = _build_mmcm_payload(clkb_mult, clkb_frac, clk_div, clk_id, clkout_div_high,clkout_div_low,duty_50_force, clkout_frac, phase_mux, phase_dalay)
 
     #
     # fre flag
@@ -322,13 +204,14 @@ def mmcm_reconfig(s, cmd, clkb_mult, clkb_frac, clk_div, clk_id, clkout_div_high
     #
     # RCEN
     #
+    send_buffers(s, payload)
     ret = cmd.cmd_send_pulse(0x01)
     s.sendall(ret)
     time.sleep(Delay)
     return 0
 
 # global variable
-lock_table = [
+lock_table = array('Q', [
 # This table is composed of:
 # LockRefDlyLockFBDlyLockCntLockSatHighUnlockCnt
 # insert underline in number: python 3.6 attribute
@@ -395,9 +278,9 @@ lock_table = [
 0b1111111111001111101011111010010000000001,
 0b1111111111001111101011111010010000000001,
 0b1111111111001111101011111010010000000001,
-0b1111111111001111101011111010010000000001]
+0b1111111111001111101011111010010000000001])
 
-filter_table_low = [
+filter_table_low = array('H', [
 # CPRESLFHF
 0b0010111100,
 0b0010111100,
@@ -462,9 +345,9 @@ filter_table_low = [
 0b0010001000,
 0b0010001000,
 0b0010001000,
-0b0010001000]
+0b0010001000])
 
-filter_table_low_ss = [
+filter_table_low_ss = array('H', [
 # CPRESLFHF
 0b0010111111,
 0b0010111111,
@@ -529,9 +412,9 @@ filter_table_low_ss = [
 0b0010001011,
 0b0010001011,
 0b0010001011,
-0b0010001011]
+0b0010001011])
 
-filter_table_high = [
+filter_table_high = array('H', [
 # CPRESLFHF
 0b0010111100,
 0b0100111100,
@@ -596,9 +479,9 @@ filter_table_high = [
 0b0010010000,
 0b0100101000,
 0b0011110000,
-0b0011110000]
+0b0011110000])
 
-filter_table_optimized = [
+filter_table_optimized = array('H', [
 # CPRESLFHF
 0b0010111100,
 0b0100111100,
@@ -663,7 +546,60 @@ filter_table_optimized = [
 0b0010010000,
 0b0100101000,
 0b0011110000,
-0b0011110000]
+0b0011110000])
+
+###################################################
+# prebuilt lock and filter registers
+###################################################
+# the lock and filter registers only depend on clkb_mult (and bandwidth),
+# so their values and the register writes 18~32 are built once at import.
+# All tables below are indexed by clkb_mult-1, like the tables above.
+filter_tables = {
+    "LOW"       : filter_table_low,
+    "LOW_SS"    : filter_table_low_ss,
+    "HIGH"      : filter_table_high,
+    "OPTIMIZED" : filter_table_optimized,
+}
+
+# reg1/2/3 for lock
+LOCK_REG1 = tuple((lock_reg >> 20) & 0x03FF for lock_reg in lock_table)
+LOCK_REG2 = tuple((((lock_reg >> 30) & 0x001F) << 10) + (lock_reg & 0x03FF) for lock_reg in lock_table)
+LOCK_REG3 = tuple((((lock_reg >> 35) & 0x001F) << 10) + ((lock_reg >> 10) & 0x03FF) for lock_reg in lock_table)
+
+# reg1/2 for filter, per bandwidth
+FILTER_REG1 = {bandwidth: tuple((((filter_reg >> 9) & 0x0001) << 15) + (((filter_reg >> 7) & 0x0003) << 11) + (((filter_reg >> 6) & 0x0001) << 8)
+                                for filter_reg in table)
+               for bandwidth, table in filter_tables.items()}
+FILTER_REG2 = {bandwidth: tuple((((filter_reg >> 5) & 0x0001) << 15) + (((filter_reg >> 3) & 0x0003) << 11) + (((filter_reg >> 1) & 0x0003) << 7) + (((filter_reg) & 0x0001) << 4)
+                                for filter_reg in table)
+               for bandwidth, table in filter_tables.items()}
+
+def _lock_cmds(i):
+    # value, bit mask (refer to datasheet), DRP Address
+    return b"".join([
+        _cmd.cmd_write_register(18,LOCK_REG1[i]),
+        _cmd.cmd_write_register(19,0xFC00),
+        _cmd.cmd_write_register(20,0x0018),
+        _cmd.cmd_write_register(21,LOCK_REG2[i]),
+        _cmd.cmd_write_register(22,0x8000),
+        _cmd.cmd_write_register(23,0x0019),
+        _cmd.cmd_write_register(24,LOCK_REG3[i]),
+        _cmd.cmd_write_register(25,0x8000),
+        _cmd.cmd_write_register(26,0x001A)])
+
+def _filter_cmds(bandwidth, i):
+    # value, bit mask (refer to datasheet), DRP Address
+    return b"".join([
+        _cmd.cmd_write_register(27,FILTER_REG1[bandwidth][i]),
+        _cmd.cmd_write_register(28,0x66FF),
+        _cmd.cmd_write_register(29,0x004E),
+        _cmd.cmd_write_register(30,FILTER_REG2[bandwidth][i]),
+        _cmd.cmd_write_register(31,0x666F),
+        _cmd.cmd_write_register(32,0x004F)])
+
+LOCK_CMDS = tuple(_lock_cmds(i) for i in range(len(lock_table)))
+FILTER_CMDS = {bandwidth: tuple(_filter_cmds(bandwidth, i) for i in range(len(table)))
+               for bandwidth, table in filter_tables.items()}
 
 if __name__ == "__main__":
     host = '192.168.2.3'
@@ -15,18 +15,9 @@ import select
 import numpy
 from mmcm_control import *
 
-s = socket.socket()
 host = '192.168.2.3'
 port = 1024
-print("connecting")
-s.connect((host,port))
-s.settimeout(0.5)
-print("connected")
-while True:
-    try :
-        s.recv(1024)
-    except socket.timeout:
-        break
+s = eth_init(host, port)
 
 cmd = Cmd()
 